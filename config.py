@@ -4,8 +4,13 @@ This module contains all the configuration constants used throughout the bot,
 including conversation states, keyboard options, and system settings.
 """
 
+import os
 from typing import Dict, List
 
+# Environment variables - read once at import (main.py loads .env before importing config)
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
 # Conversation states
 NAME = 1
 GENDER = 2
@@ -12,10 +12,42 @@ import os
 from datetime import datetime, date
 from typing import Dict, List, Optional, Any, Tuple
 
+try:
+    import orjson
+except ImportError:
+    # orjson not available on this platform, fall back to stdlib json
+    orjson = None
+
 from config import USERS_FILE, DB_NAME
 
 logger = logging.getLogger(__name__)
 
+# עמודות שנוספו לטבלת users לצורך תזמון התפריט היומי (לפי הסדר בטבלה)
+USER_SCHEDULE_COLUMNS = [
+    ("flow", "TEXT"),
+    ("calorie_budget", "INTEGER"),
+    ("daily_menu_enabled", "INTEGER DEFAULT 0"),
+    ("preferred_menu_hour", "TEXT"),
+    ("last_menu_sent", "TEXT"),
+]
+
+# מספר משתמשים מקסימלי לטרנזקציה אחת ב-save_users_bulk
+BULK_SAVE_BATCH_SIZE = 64
+
+
+def _json_dumps(obj: Any, indent: bool = False) -> str:
+    """ממיר ל-JSON (עם orjson אם זמין), בלי escape לעברית."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+
+def _json_loads(data: str) -> Any:
+    """קורא JSON (עם orjson אם זמין)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 def init_db() -> None:
     """יוצר את טבלת nutrition_logs אם אינה קיימת."""
@@ -62,8 +94,7 @@ def save_daily_entry(user_id: int, calories: int, protein: float, fat: float,
             cursor = conn.cursor()
 
             # המרת רשימת ארוחות ל-JSON
-            meals_json = json.dumps(meals_list,
-                                    ensure_ascii=False) if meals_list else "[]"
+            meals_json = _json_dumps(meals_list) if meals_list else "[]"
             today = date.today().isoformat()
 
             # בדיקה אם כבר יש רשומה ליום זה
@@ -127,12 +158,12 @@ def save_user(user_id: int, user_data: Dict[str, Any]) -> bool:
             data = {}
         else:
             with open(USERS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
+                data = _json_loads(f.read())
 
         data[str(user_id)] = user_data
 
         with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write(_json_dumps(data, indent=True))
 
         logger.info(f"Saved user data for user {user_id}")
         return True
@@ -148,7 +179,7 @@ def load_user(user_id: int) -> Optional[Dict[str, Any]]:
             return None
 
         with open(USERS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+            data = _json_loads(f.read())
 
         user_data = data.get(str(user_id))
         if user_data:
@@ -188,10 +219,24 @@ class NutritionDB:
                         diet TEXT,  -- JSON string
                         allergies TEXT,  -- JSON string
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        flow TEXT,  -- JSON string
+                        calorie_budget INTEGER,
+                        daily_menu_enabled INTEGER DEFAULT 0,
+                        preferred_menu_hour TEXT,
+                        last_menu_sent TEXT
                     )
                     """
                 )
+                self._migrate_users_table(cursor)
+
+                # אינדקס לשליפת המשתמשים שהגיע זמן התפריט היומי שלהם
+                cursor.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_due
+                    ON users(daily_menu_enabled, preferred_menu_hour, last_menu_sent)
+                    """
+                )
 
                 # טבלת יומן אכילה
                 cursor.execute(
@@ -247,6 +292,17 @@ class NutritionDB:
             logger.error(f"Error initializing NutritionDB: {e}")
             raise
 
+    @staticmethod
+    def _migrate_users_table(cursor: sqlite3.Cursor) -> None:
+        """מוסיף לטבלת users עמודות תזמון תפריט שחסרות במסדים ישנים."""
+        cursor.execute("PRAGMA table_info(users)")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, column_type in USER_SCHEDULE_COLUMNS:
+            if column not in existing:
+                cursor.execute(
+                    f"ALTER TABLE users ADD COLUMN {column} {column_type}")
+                logger.info(f"Added column {column} to users table")
+
     def save_user(self, user_id: int, user_data: Dict[str, Any]) -> bool:
         """שומר או מעדכן משתמש במסד הנתונים."""
         logger.info(f"save_user called with user_id: {user_id}, user_data keys: {list(user_data.keys()) if user_data else 'None'}")
@@ -255,37 +311,11 @@ class NutritionDB:
                 cursor = conn.cursor()
                 logger.info(f"Connected to database: {self.db_path}")
 
-                # המרת רשימות ל-JSON
-                diet_json = json.dumps(user_data.get(
-                    "diet", []), ensure_ascii=False)
-                allergies_json = json.dumps(
-                    user_data.get("allergies", []), ensure_ascii=False
-                )
-                logger.info(f"Converted diet: {diet_json}, allergies: {allergies_json}")
-
-                # הכנת הנתונים ל-INSERT
-                insert_data = (
-                        user_id,
-                        user_data.get("name"),
-                        user_data.get("age"),
-                        user_data.get("gender"),
-                        user_data.get("height"),
-                        user_data.get("weight"),
-                        user_data.get("goal"),
-                        user_data.get("activity"),
-                        diet_json,
-                        allergies_json,
-                )
+                # הכנת הנתונים ל-UPSERT (כולל המרת רשימות ל-JSON)
+                upsert_sql, insert_data = self._user_upsert(user_id, user_data)
                 logger.info(f"Insert data: {insert_data}")
 
-                cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO users
-                    (user_id, name, age, gender, height, weight, goal, activity, diet, allergies, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    """,
-                    insert_data,
-                )
+                cursor.execute(upsert_sql, insert_data)
                 logger.info(f"SQL executed successfully, rows affected: {cursor.rowcount}")
                 
                 conn.commit()
@@ -298,32 +328,99 @@ class NutritionDB:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return False
 
+    def save_users_bulk(self, updates: List[Tuple[int, Dict[str, Any]]]) -> bool:
+        """מעדכן flow ו-last_menu_sent לכמה משתמשים - טרנזקציה אחת לכל מנה של BULK_SAVE_BATCH_SIZE.
+
+        רק העמודות שה-scheduler משנה נכתבות, כדי לא לדרוס עדכוני פרופיל שנעשו בזמן השליחה.
+        """
+        if not updates:
+            return True
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                for start in range(0, len(updates), BULK_SAVE_BATCH_SIZE):
+                    batch = updates[start:start + BULK_SAVE_BATCH_SIZE]
+                    cursor.executemany(
+                        """
+                        UPDATE users
+                        SET flow = ?, last_menu_sent = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE user_id = ?
+                        """,
+                        [
+                            (
+                                _json_dumps(user_data.get("flow", {})),
+                                user_data.get("last_menu_sent"),
+                                user_id,
+                            )
+                            for user_id, user_data in batch
+                        ],
+                    )
+                    conn.commit()
+                logger.info(f"Saved {len(updates)} users in bulk")
+                return True
+        except Exception as e:
+            logger.error(f"Error saving users in bulk: {e}")
+            return False
+
+    @staticmethod
+    def _user_upsert(user_id: int, user_data: Dict[str, Any]) -> Tuple[str, Tuple[Any, ...]]:
+        """בונה שאילתת UPSERT וערכים לשמירת משתמש.
+
+        עמודות הפרופיל נכתבות תמיד. עמודות התזמון נכתבות רק אם המפתח קיים ב-user_data
+        (או באיפוס, כש-user_data ריק), כי context.user_data ריק אחרי restart
+        ושמירה ממנו לא אמורה לבטל מנוי לתפריט היומי.
+        """
+        values = {
+            "name": user_data.get("name"),
+            "age": user_data.get("age"),
+            "gender": user_data.get("gender"),
+            "height": user_data.get("height"),
+            "weight": user_data.get("weight"),
+            "goal": user_data.get("goal"),
+            "activity": user_data.get("activity"),
+            "diet": _json_dumps(user_data.get("diet", [])),
+            "allergies": _json_dumps(user_data.get("allergies", [])),
+        }
+        schedule_values = {
+            "flow": _json_dumps(user_data.get("flow", {})),
+            "calorie_budget": user_data.get("calorie_budget"),
+            "daily_menu_enabled": int(bool(user_data.get("daily_menu_enabled", False))),
+            "preferred_menu_hour": user_data.get("preferred_menu_hour"),
+            "last_menu_sent": user_data.get("last_menu_sent"),
+        }
+        values.update({
+            column: value for column, value in schedule_values.items()
+            if not user_data or column in user_data
+        })
+        columns = ["user_id", *values]
+        sql = f"""
+            INSERT INTO users ({", ".join(columns)}, updated_at)
+            VALUES ({", ".join("?" for _ in columns)}, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+            {", ".join(f"{column} = excluded.{column}" for column in values)},
+            updated_at = CURRENT_TIMESTAMP
+        """
+        return sql, (user_id, *values.values())
+
     def load_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """טוען משתמש ממסד הנתונים."""
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
-                    "SELECT * FROM users WHERE user_id = ?", (user_id,)
+                    """
+                    SELECT user_id, name, age, gender, height, weight, goal,
+                           activity, diet, allergies, created_at, updated_at,
+                           flow, calorie_budget, daily_menu_enabled,
+                           preferred_menu_hour, last_menu_sent
+                    FROM users WHERE user_id = ?
+                    """,
+                    (user_id,),
                 )
                 row = cursor.fetchone()
 
                 if row:
-                    # המרת JSON חזרה לרשימות
-                    user_data = {
-                        "user_id": row[0],
-                        "name": row[1],
-                        "age": row[2],
-                        "gender": row[3],
-                        "height": row[4],
-                        "weight": row[5],
-                        "goal": row[6],
-                        "activity": row[7],
-                        "diet": json.loads(row[8]) if row[8] else [],
-                        "allergies": json.loads(row[9]) if row[9] else [],
-                        "created_at": row[10],
-                        "updated_at": row[11],
-                    }
+                    user_data = {"user_id": row[0], **self._user_row_to_dict(row)}
                     logger.info(f"Loaded user {user_id} from database")
                     return user_data
                 return None
@@ -586,7 +683,9 @@ class NutritionDB:
                 cursor.execute(
                     """
                     SELECT user_id, name, age, gender, height, weight, goal, 
-                           activity, diet, allergies, created_at, updated_at
+                           activity, diet, allergies, created_at, updated_at,
+                           flow, calorie_budget, daily_menu_enabled,
+                           preferred_menu_hour, last_menu_sent
                     FROM users
                     """
                 )
@@ -594,26 +693,76 @@ class NutritionDB:
                 
                 users = {}
                 for row in rows:
-                    user_id = row[0]
-                    users[user_id] = {
-                        "name": row[1],
-                        "age": row[2],
-                        "gender": row[3],
-                        "height": row[4],
-                        "weight": row[5],
-                        "goal": row[6],
-                        "activity": row[7],
-                        "diet": json.loads(row[8]) if row[8] else [],
-                        "allergies": json.loads(row[9]) if row[9] else [],
-                        "created_at": row[10],
-                        "updated_at": row[11]
-                    }
+                    users[row[0]] = self._user_row_to_dict(row)
                 
                 return users
         except Exception as e:
             logger.error(f"Error getting all users: {e}")
             return {}
 
+    def get_menu_subscribers(self) -> List[Tuple[int, Optional[str]]]:
+        """מחזיר (user_id, preferred_menu_hour) לכל המשתמשים שרשומים לתפריט יומי."""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT user_id, preferred_menu_hour FROM users
+                    WHERE daily_menu_enabled = 1
+                    """
+                )
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting menu subscribers: {e}")
+            return []
+
+    def get_due_users(
+        self, menu_hour: str, current_date: str
+    ) -> List[Tuple[int, Dict[str, Any]]]:
+        """מחזיר משתמשים שרשומים לתפריט בשעה menu_hour ועוד לא קיבלו אותו בתאריך current_date."""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT user_id, name, age, gender, height, weight, goal,
+                           activity, diet, allergies, created_at, updated_at,
+                           flow, calorie_budget, daily_menu_enabled,
+                           preferred_menu_hour, last_menu_sent
+                    FROM users
+                    WHERE daily_menu_enabled = 1
+                      AND preferred_menu_hour = ?
+                      AND (last_menu_sent IS NULL OR last_menu_sent < ?)
+                    """,
+                    (menu_hour, current_date)
+                )
+                return [(row[0], self._user_row_to_dict(row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting due users: {e}")
+            return []
+
+    @staticmethod
+    def _user_row_to_dict(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        """ממיר שורה מטבלת users (בלי user_id) למילון נתוני משתמש."""
+        return {
+            "name": row[1],
+            "age": row[2],
+            "gender": row[3],
+            "height": row[4],
+            "weight": row[5],
+            "goal": row[6],
+            "activity": row[7],
+            "diet": _json_loads(row[8]) if row[8] else [],
+            "allergies": _json_loads(row[9]) if row[9] else [],
+            "created_at": row[10],
+            "updated_at": row[11],
+            "flow": _json_loads(row[12]) if row[12] else {},
+            "calorie_budget": row[13],
+            "daily_menu_enabled": bool(row[14]),
+            "preferred_menu_hour": row[15],
+            "last_menu_sent": row[16],
+        }
+
 
 # Wrapper functions for backward compatibility
 def save_user_data(user_id: int, user_data: Dict[str, Any]) -> bool:
@@ -22,6 +22,7 @@ from telegram.ext import ContextTypes, ConversationHandler
 import telegram
 
 from db import NutritionDB, save_user_data
+from menu_scheduler import schedule_user_menu
 
 from config import (
     NAME,
@@ -2644,7 +2645,8 @@ async def schedule_menu(
             context
         )
     elif time == "מעדיפה לבקש לבד":
-        context.user_data["preferred_menu_hour"] = "מעדיף לבקש לבד"
+        # ביטול נשמר כדגל בוליאני בלבד, בלי שעה
+        context.user_data["preferred_menu_hour"] = None
         context.user_data["daily_menu_enabled"] = False
         msg = gendered_text(
             "לא אשלח תפריט אוטומטי. אפשר לבקש תפריט יומי בכל עת מהתפריט הראשי.",
@@ -2664,6 +2666,11 @@ async def schedule_menu(
         from datetime import datetime
         context.user_data["last_menu_schedule_update"] = datetime.now().isoformat()
         nutrition_db.save_user(user_id, context.user_data)
+        schedule_user_menu(
+            context.job_queue,
+            user_id,
+            context.user_data.get("preferred_menu_hour") if context.user_data["daily_menu_enabled"] else None,
+        )
     if update.message:
         try:
             await update.message.reply_text(
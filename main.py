@@ -6,11 +6,11 @@ and conversation flows for nutrition management.
 """
 
 import asyncio
+import concurrent.futures
 import json
 import logging
-import os
-import datetime
-import requests
+import re
+import sys
 
 # Load environment variables from .env file (if available)
 try:
@@ -22,6 +22,7 @@ except ImportError:
 
 from telegram import Update
 from telegram.ext import CallbackQueryHandler
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -62,6 +63,8 @@ from config import (
     NAME,
     USERS_FILE,
     DB_NAME,
+    TELEGRAM_TOKEN,
+    OPENAI_API_KEY,
 )
 from handlers import (
     start,
@@ -116,8 +119,10 @@ from handlers import (
     reset_command,
     handle_reset_confirmation,
 )
-from utils import build_main_keyboard
 from db import NutritionDB
+from menu_scheduler import flush_pending_saves, start_scheduler
+from send_queue import start_send_workers, stop_send_workers
+from utils import close_http_client
 
 # Configure logging
 logging.basicConfig(
@@ -132,150 +137,92 @@ nutrition_db = NutritionDB()
 # File paths
 DAILY_MENUS_FILE = "daily_menus.json"
 
+DB_THREAD_WORKERS = 4
+
+# כל כפתורי הטקסט בביטוי אחד - קבוצה שנתפסה קובעת לאיזה handler לנתב
+DISPATCH_RE = re.compile(
+    r"^(?:"
+    r"(?P<menu>לקבלת תפריט יומי מותאם אישית|מה אכלתי היום|בניית ארוחה לפי מה שיש לי בבית|קבלת דוח|תזכורות על שתיית מים)"
+    r"|(?P<summary>✅ סיימתי להיום|סיימתי(?: להיום)?[.!]?)"
+    r"|(?P<help>עזרה)"
+    r"|(?P<help_action>שאל שאלה חופשית|שאלי שאלה חופשית|מעבר לשאלון אישי)"
+    r"|(?P<yes_no>כן|לא)"
+    r")$"
+)
 
-async def daily_menu_scheduler(context):
-    """שולח תפריט יומי למשתמשים שנרשמו לכך, בשעה שנבחרה."""
-    try:
-        now = datetime.datetime.now()
-        current_hour = now.strftime("%H:00")
-        current_date = now.date().isoformat()
-        
-        # קבל את כל המשתמשים מהמסד
-        all_users = nutrition_db.get_all_users()
-        
-        for user_id, user_data in all_users.items():
-            try:
-                # בדוק אם המשתמש השלים את הסקר
-                if not user_data.get("flow", {}).get("setup_complete", False):
-                    logger.info(f"User {user_id} has not completed setup, skipping daily menu")
-                    continue
-                
-                # בדוק אם המשתמש רשום לתפריט אוטומטי
-                if not user_data.get("daily_menu_enabled", False):
-                    continue
-                    
-                # בדוק אם השעה מתאימה
-                preferred_hour = user_data.get("preferred_menu_hour")
-                if preferred_hour != current_hour:
-                    continue
-                
-                # בדוק אם כבר נשלח היום
-                last_menu_sent = user_data.get("last_menu_sent")
-                if last_menu_sent:
-                    try:
-                        last_sent_date = datetime.datetime.fromisoformat(last_menu_sent).date()
-                        if last_sent_date >= now.date():
-                            logger.info(f"Menu already sent today for user {user_id}")
-                            continue
-                    except Exception as e:
-                        logger.error(f"Error parsing last_menu_sent for user {user_id}: {e}")
-                
-                # בדוק אם המשתמש בחר "מעדיף לבקש לבד"
-                if preferred_hour == "מעדיף לבקש לבד":
-                    continue
-                
-                # שלח תקציב קלוריות
-                calorie_budget = user_data.get("calorie_budget", 0)
-                calorie_msg = f"📌 תקציב הקלוריות היומי שלך: {calorie_budget} קלוריות"
-                
-                try:
-                    calorie_message = await context.bot.send_message(
-                        chat_id=user_id,
-                        text=calorie_msg,
-                    )
-                    
-                    # הצמד הודעה
-                    try:
-                        chat = await context.bot.get_chat(user_id)
-                        await chat.pin_message(calorie_message.message_id)
-                    except Exception as e:
-                        logger.error(f"Error pinning calorie message for user {user_id}: {e}")
-                        
-                except Exception as e:
-                    logger.error(f"Error sending calorie message to user {user_id}: {e}")
-                    continue
-                
-                # שלח הודעת תפריט יומי
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="🍽️ התפריט היומי שלך מוכן! לחץ על 'לקבלת תפריט יומי מותאם אישית'",
-                        reply_markup=build_main_keyboard(),
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending menu notification to user {user_id}: {e}")
-                    continue
-                
-                # עדכן את מספר היום
-                current_day = user_data.get("flow", {}).get("day_count", 0)
-                user_data["flow"] = {
-                    "stage": "tracking", 
-                    "setup_complete": True,
-                    "day_count": current_day + 1
-                }
-                
-                # תעד מועד שליחה במסד
-                user_data["last_menu_sent"] = now.isoformat()
-                # איפוס כפתור התפריט היומי כדי שיופיע מחר
-                user_data["menu_sent_today"] = True
-                user_data["menu_sent_date"] = now.date().isoformat()
-                nutrition_db.save_user(user_id, user_data)
-                
-                logger.info(f"Sent daily menu to user {user_id}")
-                
-            except Exception as e:
-                logger.error(f"Error processing user {user_id} in daily menu scheduler: {e}")
-                continue
-                
-    except Exception as e:
-        logger.error(f"Error in daily menu scheduler: {e}")
-
-
-def start_scheduler(application):
-    """מתחיל את ה-scheduler לשליחת תפריטים אוטומטיים."""
-    job_queue = application.job_queue
-    
-    # הפעל את הבדיקה כל 10 דקות
-    job_queue.run_repeating(
-        daily_menu_scheduler,
-        interval=datetime.timedelta(minutes=10),
-        first=datetime.timedelta(seconds=30)  # התחל אחרי 30 שניות
+TEXT_ROUTES = {
+    "menu": handle_daily_choice,
+    "summary": send_summary,
+    "help": handle_help,
+    "help_action": handle_help_action,
+    # כפתור עדכון פרטים אישיים
+    "yes_no": handle_update_personal_details_response,
+}
+
+
+async def dispatch_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """מנתב הודעת טקסט ל-handler המתאים עם התאמת regex אחת; אחרת - טקסט חופשי."""
+    message = update.effective_message
+    match = DISPATCH_RE.match(message.text) if message and message.text else None
+    handler = TEXT_ROUTES[match.lastgroup] if match else handle_free_text_input
+    return await handler(update, context)
+
+
+async def _post_init(application):
+    """רץ בתוך לולאת האירועים לפני תחילת ה-polling."""
+    # מאגר threads חסום לקריאות DB סינכרוניות (asyncio.to_thread)
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=DB_THREAD_WORKERS)
     )
-    
-    logger.info("Daily menu scheduler started - checking every 10 minutes")
+    # מחיקת webhook דרך מאגר החיבורים של הבוט (נדרש לפני polling)
+    result = await application.bot.delete_webhook(drop_pending_updates=True)
+    logger.info("[WEBHOOK DELETE] %s", result)
+    start_send_workers()
 
 
-def delete_webhook():
-    token = os.environ.get("TELEGRAM_TOKEN")
-    if not token:
-        print("[ERROR] TELEGRAM_TOKEN not found in environment")
-        return
-    url = f"https://api.telegram.org/bot{token}/deleteWebhook"
-    response = requests.post(url)
-    print(f"[WEBHOOK DELETE] {response.status_code} - {response.text}")
+async def _post_shutdown(application):
+    await stop_send_workers()
+    await flush_pending_saves()
+    await close_http_client()
 
 
 def main():
-    delete_webhook()  # שלב 1: מחיקת webhook
     logger.info("[MAIN] Bot main() started")
-    logger.info(f"[MAIN] Environment: TELEGRAM_TOKEN={'SET' if os.getenv('TELEGRAM_TOKEN') else 'NOT_SET'}")
-    logger.info(f"[MAIN] Environment: OPENAI_API_KEY={'SET' if os.getenv('OPENAI_API_KEY') else 'NOT_SET'}")
-    
-    # Get bot token from environment
-    bot_token = os.getenv("TELEGRAM_TOKEN")
-    if not bot_token or bot_token == "your_telegram_bot_token_here":
+    logger.info(
+        "[MAIN] Environment: TELEGRAM_TOKEN=%s OPENAI_API_KEY=%s",
+        "SET" if TELEGRAM_TOKEN else "NOT_SET",
+        "SET" if OPENAI_API_KEY else "NOT_SET",
+    )
+
+    if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "your_telegram_bot_token_here":
         logger.error("TELEGRAM_TOKEN not found or not properly configured in environment variables")
         logger.error("Please set TELEGRAM_TOKEN in your .env file or environment variables")
         raise ValueError("TELEGRAM_TOKEN not configured")
 
-    # Get OpenAI API key from environment
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if not openai_key:
+    if not OPENAI_API_KEY:
         logger.warning("OPENAI_API_KEY not found in environment variables - GPT features will not work")
 
+    # uvloop מהיר יותר מלולאת ה-asyncio הרגילה; run_polling ישתמש בו אוטומטית
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            uvloop.install()
+            logger.info("[MAIN] Using uvloop event loop")
+        except ImportError:
+            logger.info("[MAIN] uvloop not available, using default asyncio event loop")
+
     # Create application
     try:
-        application = Application.builder().token(bot_token).build()
+        # מאגר חיבורים גדול ו-HTTP/2 לשליחות; getUpdates מקבל מאגר נפרד כי long polling תופס חיבור
+        application = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .request(HTTPXRequest(connection_pool_size=256, http_version="2"))
+            .get_updates_request(HTTPXRequest(http_version="2"))
+            .post_init(_post_init)
+            .post_shutdown(_post_shutdown)
+            .build()
+        )
     except Exception as e:
         logger.error(f"Failed to create application: {e}")
         raise
@@ -319,20 +266,9 @@ def main():
     )
     application.add_handler(conv_handler)
 
-    # Add handlers for main menu options
-    menu_regex = r"^(לקבלת תפריט יומי מותאם אישית|מה אכלתי היום|בניית ארוחה לפי מה שיש לי בבית|קבלת דוח|תזכורות על שתיית מים)$"
+    # Handler אחד לכל הודעות הטקסט: כפתורי התפריט, עזרה, כן/לא וטקסט חופשי
     application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.Regex(menu_regex),
-            handle_daily_choice))
-
-    # Handler לכפתור 'סיימתי להיום' או 'סיימתי' (כולל וריאציות)
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.Regex(r"^✅ סיימתי להיום$|^סיימתי( להיום)?[.!]?$"),
-            send_summary
-        )
-    )
+        MessageHandler(filters.TEXT & ~filters.COMMAND, dispatch_text_message))
 
     # Add handler for report menu callback
     application.add_handler(CallbackQueryHandler(handle_report_request, pattern=r"^report_(daily|weekly|monthly|smart_feedback)$"))
@@ -340,48 +276,20 @@ def main():
     # Add handler for reset confirmation
     application.add_handler(CallbackQueryHandler(handle_reset_confirmation, pattern=r"^reset_(confirm|cancel)$"))
 
-    # Add handler for help button ("עזרה")
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.Regex(r"^עזרה$"),
-            handle_help
-        )
-    )
-
-    # Add handler for help action buttons
-    help_action_regex = r"^(שאל שאלה חופשית|שאלי שאלה חופשית|מעבר לשאלון אישי)$"
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.Regex(help_action_regex),
-            handle_help_action
-        )
-    )
-
-    # Add handler לכפתור עדכון פרטים אישיים (חייב להיות לפני free text)
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.Regex(r"^(כן|לא)$"),
-            handle_update_personal_details_response
-        )
-    )
-
     # Add command handlers
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("menu", show_daily_menu))
     application.add_handler(CommandHandler("reset", reset_command))
 
-    # Add handler for free text input (רק אחרי כל ההנדלרים הספציפיים)
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & ~filters.COMMAND & ~filters.Regex(menu_regex) & ~filters.Regex(help_action_regex) & ~filters.Regex(r"^(כן|לא)$"),
-            handle_free_text_input
-        )
-    )
-
-    # Handler כללי שמדפיס כל update שמתקבל (רק אחד!)
-    async def log_update(update, context):
-        logger.info(f"[UPDATE] Received update: {update.update_id} from user {update.effective_user.id if update.effective_user else 'Unknown'}")
-    application.add_handler(MessageHandler(filters.ALL, log_update), group=0)
+    # Handler כללי שמדפיס כל update שמתקבל - רק במצב DEBUG, כדי לא להכפיל עבודה על כל update
+    if logger.isEnabledFor(logging.DEBUG):
+        async def log_update(update, context):
+            logger.debug(
+                "[UPDATE] Received update: %s from user %s",
+                update.update_id,
+                update.effective_user.id if update.effective_user else "Unknown",
+            )
+        application.add_handler(MessageHandler(filters.ALL, log_update), group=-1)
 
     # Add global error handler
     async def global_error_handler(update, context):
@@ -0,0 +1,260 @@
+"""
+Daily menu scheduling for the Calorico Telegram bot.
+
+Every user who opted in to an automatic daily menu gets a dedicated cron job
+at their preferred hour, so the scheduler only wakes up for users that are
+actually due instead of scanning the whole users table.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import Any, Dict, Optional, Set
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.cron import CronTrigger
+
+from config import DB_NAME
+from db import NutritionDB
+from send_queue import enqueue_send
+from utils import build_main_keyboard
+
+logger = logging.getLogger(__name__)
+
+nutrition_db = NutritionDB()
+
+# שם ה-jobstore הקבוע (SQLite) שבו נשמרים ג'ובי התפריט היומי
+MENU_JOBSTORE = "menus"
+
+# ה-Application הפעיל - נדרש כי ג'ובים שמורים מקבלים רק user_id
+_application = None
+
+# מספר משתמשים מקסימלי שמקבלים תפריט במקביל
+CONCURRENT_MENU_SENDS = 20
+_send_semaphore = asyncio.Semaphore(CONCURRENT_MENU_SENDS)
+
+# המקלדת הראשית (בלי נתוני משתמש) זהה לכולם - נבנית פעם אחת
+MAIN_KEYBOARD = build_main_keyboard()
+
+# עדכוני משתמשים אחרי שליחה נאספים ונכתבים למסד בכתיבה מרוכזת אחת
+SAVE_FLUSH_DELAY = 1.0
+_pending_saves: Dict[int, Dict[str, Any]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+def _menu_job_id(user_id: int) -> str:
+    return f"menu_{user_id}"
+
+
+def _is_valid_menu_hour(preferred_hour: Optional[str]) -> bool:
+    """בודק שהשעה בפורמט HH:00."""
+    return bool(
+        preferred_hour
+        and len(preferred_hour) == 5
+        and preferred_hour[:2].isdigit()
+        and preferred_hour[2:] == ":00"
+    )
+
+
+def schedule_user_menu(job_queue, user_id: int, preferred_hour: Optional[str]) -> None:
+    """רושם (או מחליף) ג'וב יומי למשתמש בשעה שבחר, או מסיר אותו אם ביטל."""
+    if job_queue is None:
+        logger.warning("No job queue available, cannot schedule menu for user %s", user_id)
+        return
+    if not _is_valid_menu_hour(preferred_hour):
+        unschedule_user_menu(job_queue, user_id)
+        return
+    job_queue.scheduler.add_job(
+        send_one_user_menu,
+        CronTrigger(hour=int(preferred_hour[:2]), minute=0),
+        id=_menu_job_id(user_id),
+        args=[user_id],
+        jobstore=MENU_JOBSTORE,
+        replace_existing=True,
+        misfire_grace_time=3600,
+        coalesce=True,
+    )
+    logger.info("Scheduled daily menu for user %s at %s", user_id, preferred_hour)
+
+
+def unschedule_user_menu(job_queue, user_id: int) -> None:
+    """מסיר את הג'וב היומי של המשתמש אם קיים."""
+    if job_queue is None:
+        return
+    try:
+        job_queue.scheduler.remove_job(_menu_job_id(user_id), jobstore=MENU_JOBSTORE)
+        logger.info("Removed daily menu job for user %s", user_id)
+    except JobLookupError:
+        pass
+
+
+async def send_one_user_menu(user_id: int) -> None:
+    """שולח תפריט יומי למשתמש אחד - מופעל ע"י הג'וב היומי שלו."""
+    # כל הג'ובים של אותה שעה נורים יחד - מגבילים כמה משתמשים מטופלים במקביל
+    async with _send_semaphore:
+        await _send_one_user_menu(user_id)
+
+
+async def _send_one_user_menu(user_id: int) -> None:
+    if _application is None:
+        logger.error("Daily menu job fired for user %s before scheduler start", user_id)
+        return
+    bot = _application.bot
+    try:
+        user_data = await asyncio.to_thread(nutrition_db.load_user, user_id)
+        if not user_data:
+            logger.info("User %s not found, removing daily menu job", user_id)
+            unschedule_user_menu(_application.job_queue, user_id)
+            return
+
+        # בדוק אם המשתמש השלים את הסקר
+        if not user_data.get("flow", {}).get("setup_complete", False):
+            logger.info("User %s has not completed setup, skipping daily menu", user_id)
+            return
+
+        # בדוק אם המשתמש עדיין רשום לתפריט אוטומטי
+        if not user_data.get("daily_menu_enabled", False):
+            unschedule_user_menu(_application.job_queue, user_id)
+            return
+
+        current_date = datetime.date.today().isoformat()
+
+        # בדוק אם כבר נשלח היום (השוואת YYYY-MM-DD כמחרוזת)
+        last_menu_sent = user_data.get("last_menu_sent")
+        if last_menu_sent and last_menu_sent[:10] >= current_date:
+            logger.info("Menu already sent today for user %s", user_id)
+            return
+
+        # שלח תקציב קלוריות
+        calorie_budget = user_data.get("calorie_budget", 0)
+        calorie_msg = f"📌 תקציב הקלוריות היומי שלך: {calorie_budget} קלוריות"
+
+        try:
+            calorie_message = await enqueue_send(lambda: bot.send_message(
+                chat_id=user_id,
+                text=calorie_msg,
+            ))
+        except Exception as e:
+            logger.error("Error sending calorie message to user %s: %s", user_id, e)
+            return
+
+        # הצמד הודעה ושלח הודעת תפריט יומי במקביל דרך התור
+        pin_result, menu_result = await asyncio.gather(
+            enqueue_send(lambda: bot.pin_chat_message(
+                chat_id=user_id,
+                message_id=calorie_message.message_id,
+                disable_notification=True,
+            )),
+            enqueue_send(lambda: bot.send_message(
+                chat_id=user_id,
+                text="🍽️ התפריט היומי שלך מוכן! לחץ על 'לקבלת תפריט יומי מותאם אישית'",
+                reply_markup=MAIN_KEYBOARD,
+            )),
+            return_exceptions=True,
+        )
+        if isinstance(pin_result, Exception):
+            logger.error("Error pinning calorie message for user %s: %s", user_id, pin_result)
+        if isinstance(menu_result, Exception):
+            logger.error("Error sending menu notification to user %s: %s", user_id, menu_result)
+            return
+
+        # עדכן את מספר היום
+        current_day = user_data.get("flow", {}).get("day_count", 0)
+        user_data["flow"] = {
+            "stage": "tracking",
+            "setup_complete": True,
+            "day_count": current_day + 1
+        }
+
+        # תעד מועד שליחה במסד
+        user_data["last_menu_sent"] = current_date
+        # איפוס כפתור התפריט היומי כדי שיופיע מחר
+        user_data["menu_sent_today"] = True
+        user_data["menu_sent_date"] = current_date
+        _queue_user_save(user_id, user_data)
+
+        # עדכון גם ב-user_data שבזיכרון, כדי ששמירה הבאה מה-handlers לא תחזיר flow ישן
+        _application.user_data[user_id].update(
+            flow=user_data["flow"],
+            last_menu_sent=current_date,
+            menu_sent_today=True,
+            menu_sent_date=current_date,
+        )
+
+        logger.info("Sent daily menu to user %s", user_id)
+
+    except Exception as e:
+        logger.error("Error sending daily menu to user %s: %s", user_id, e)
+
+
+def _queue_user_save(user_id: int, user_data: Dict[str, Any]) -> None:
+    """מוסיף עדכון משתמש לכתיבה המרוכזת הבאה."""
+    global _flush_task
+    _pending_saves[user_id] = user_data
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_user_saves_later())
+
+
+async def _flush_user_saves_later() -> None:
+    # ג'ובים של אותה שעה רצים יחד - ממתינים רגע כדי לאסוף את כולם לכתיבה אחת
+    while _pending_saves:
+        await asyncio.sleep(SAVE_FLUSH_DELAY)
+        await flush_pending_saves()
+
+
+async def flush_pending_saves() -> None:
+    """כותב למסד את כל עדכוני המשתמשים שממתינים."""
+    if not _pending_saves:
+        return
+    updates = list(_pending_saves.items())
+    _pending_saves.clear()
+    await asyncio.to_thread(nutrition_db.save_users_bulk, updates)
+
+
+def _schedule_missing_menu_jobs(job_queue) -> Set[int]:
+    """רושם ג'וב למנויים שאין להם ג'וב שמור. רץ ב-thread - כל הקריאות כאן ל-SQLite חוסמות."""
+    # ג'וב שמור נשאר כמו שהוא כדי ש-misfire_grace_time יחול אחרי restart
+    stored_job_ids = {job.id for job in job_queue.scheduler.get_jobs(jobstore=MENU_JOBSTORE)}
+    newly_registered = set()
+    for user_id, preferred_hour in nutrition_db.get_menu_subscribers():
+        if _menu_job_id(user_id) in stored_job_ids:
+            continue
+        schedule_user_menu(job_queue, user_id, preferred_hour)
+        newly_registered.add(user_id)
+    return newly_registered
+
+
+async def _register_menu_jobs(context) -> None:
+    """רושם ג'וב יומי לכל משתמש רשום שעדיין אין לו ג'וב שמור."""
+    newly_registered = await asyncio.to_thread(_schedule_missing_menu_jobs, context.job_queue)
+    logger.info("Registered %s new daily menu jobs", len(newly_registered))
+
+    # ג'וב חדש ירוץ רק מחר - משתמשים שהשעה שלהם היא השעה הנוכחית יקבלו עכשיו
+    if not newly_registered:
+        return
+    now = datetime.datetime.now()
+    current_hour = now.strftime("%H:00")
+    due_users = await asyncio.to_thread(
+        nutrition_db.get_due_users, current_hour, now.date().isoformat()
+    )
+    await asyncio.gather(
+        *(send_one_user_menu(user_id) for user_id, _ in due_users if user_id in newly_registered),
+        return_exceptions=True,
+    )
+
+
+def start_scheduler(application):
+    """מחבר את ה-jobstore הקבוע ורושם ג'וב תפריט יומי לכל משתמש רשום."""
+    global _application
+    _application = application
+    job_queue = application.job_queue
+
+    job_queue.scheduler.add_jobstore(
+        SQLAlchemyJobStore(url=f"sqlite:///{DB_NAME}"), alias=MENU_JOBSTORE
+    )
+
+    # הרישום רץ אחרי שה-scheduler עלה, כדי לזהות ג'ובים שכבר שמורים
+    job_queue.run_once(_register_menu_jobs, when=0)
+
+    logger.info("Daily menu scheduler started - one cron job per subscribed user")
@@ -0,0 +1,95 @@
+"""
+Global outgoing-message queue for the Calorico Telegram bot.
+
+Bulk sends (such as the daily menu fan-out) go through a single queue drained
+by a few workers that share one token bucket, so requests are pipelined but
+never exceed Telegram's bot-wide limit of 30 messages per second.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# מגבלת טלגרם הגלובלית לבוט
+MESSAGES_PER_SECOND = 30
+SEND_WORKERS = 5
+
+telegram_send_queue: asyncio.Queue = asyncio.Queue()
+
+_workers: List[asyncio.Task] = []
+_bucket_lock = asyncio.Lock()
+_next_send_at = 0.0
+# מנוקה בזמן RetryAfter כדי לעצור את כל העובדים יחד
+_sending_allowed = asyncio.Event()
+_sending_allowed.set()
+
+
+async def enqueue_send(coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+    """מכניס קריאת API לתור וממתין לתוצאה שלה."""
+    future = asyncio.get_running_loop().create_future()
+    await telegram_send_queue.put((coro_factory, future))
+    return await future
+
+
+async def _acquire_token() -> None:
+    """ממתין לתור הפנוי הבא בדלי (1/30 שנייה בין שליחות)."""
+    global _next_send_at
+    async with _bucket_lock:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if _next_send_at > now:
+            await asyncio.sleep(_next_send_at - now)
+            now = loop.time()
+        _next_send_at = now + 1 / MESSAGES_PER_SECOND
+
+
+def _pause_sending(seconds: float) -> None:
+    """עוצר את כל השליחות למשך הזמן שטלגרם ביקש."""
+    if _sending_allowed.is_set():
+        logger.warning("Telegram flood limit hit, pausing sends for %ss", seconds)
+        _sending_allowed.clear()
+        asyncio.get_running_loop().call_later(seconds, _sending_allowed.set)
+
+
+async def _send_worker() -> None:
+    while True:
+        coro_factory, future = await telegram_send_queue.get()
+        try:
+            while not future.cancelled():
+                await _sending_allowed.wait()
+                await _acquire_token()
+                try:
+                    result = await coro_factory()
+                except RetryAfter as e:
+                    _pause_sending(e.retry_after)
+                    continue
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                    break
+                if not future.cancelled():
+                    future.set_result(result)
+                break
+        finally:
+            telegram_send_queue.task_done()
+
+
+def start_send_workers() -> None:
+    """מפעיל את עובדי התור - חייב לרוץ בתוך לולאת האירועים של הבוט."""
+    if _workers:
+        return
+    for i in range(SEND_WORKERS):
+        _workers.append(asyncio.create_task(_send_worker(), name=f"telegram_send_worker_{i}"))
+    logger.info("Started %s Telegram send workers", SEND_WORKERS)
+
+
+async def stop_send_workers() -> None:
+    """עוצר את עובדי התור בעת כיבוי הבוט."""
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -11,15 +11,23 @@ import logging
 from typing import List, Optional
 from telegram import KeyboardButton, ReplyKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-import os
+import httpx
 import openai
 import json
 
+from config import OPENAI_API_KEY
+
 logger = logging.getLogger(__name__)
 
 # Global variable to store OpenAI client
 OPENAI_CLIENT = None
 
+# לקוח HTTP משותף לכל הקריאות החיצוניות (OpenAI) - חיבורים חמים ו-HTTP/2
+HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=64),
+)
+
 # מילון אימוג'י למזון
 FOOD_EMOJI_MAP = {
     # בשר ודגים
@@ -98,6 +106,19 @@ def set_openai_client(client):
     OPENAI_CLIENT = client
 
 
+def get_async_openai_client(api_key: str):
+    """מחזיר לקוח OpenAI אסינכרוני יחיד שמשתמש ב-HTTP_CLIENT המשותף."""
+    global OPENAI_CLIENT
+    if OPENAI_CLIENT is None:
+        OPENAI_CLIENT = openai.AsyncOpenAI(api_key=api_key, http_client=HTTP_CLIENT)
+    return OPENAI_CLIENT
+
+
+async def close_http_client():
+    """סוגר את לקוח ה-HTTP המשותף בעת כיבוי הבוט."""
+    await HTTP_CLIENT.aclose()
+
+
 def strip_html_tags(text: str) -> str:
     """מסיר תגיות HTML מהטקסט."""
     if not text:
@@ -449,13 +470,12 @@ def build_user_prompt_for_gpt(user_data: dict) -> str:
 async def call_gpt(prompt: str) -> str:
     """קורא ל-GPT API ומחזיר תשובה."""
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        if not OPENAI_API_KEY:
             logger.error("OpenAI API key not found")
             return get_gendered_text(None, 
                 "לא הצלחתי ליצור קשר עם שירות ה-AI. אנא נסה שוב מאוחר יותר.",
                 "לא הצלחתי ליצור קשר עם שירות ה-AI. אנא נסי שוב מאוחר יותר.")
-        client = openai.AsyncOpenAI(api_key=api_key)
+        client = get_async_openai_client(OPENAI_API_KEY)
         response = await client.chat.completions.create(
             model="gpt-4-0125-preview",  # או "gpt-4o"
             messages=[{"role": "user", "content": prompt}],